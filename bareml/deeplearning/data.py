@@ -1,11 +1,15 @@
 from abc import ABCMeta, abstractmethod
 import os
+import sys
+import time
 import gzip
 import tarfile
 import urllib.request
 import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from .transforms import Compose, Flatten, ToFloat, Normalise
+from numpy.lib.stride_tricks import sliding_window_view
+from .transforms import Compose, FlattenNormalise
 from .utils import replace_symbols, replace_email, replace_numbers, replace_tab, single_spacing, fix_multidots
 
 # matplotlib is not in dependency list (optional)
@@ -24,16 +28,30 @@ except ImportError:
 CACHE_DIR = os.path.join(os.path.expanduser('~'), '.bareml')
 
 
+# time of the last progress bar update, see show_progress
+_last_progress_time = 0.
+
+
 def show_progress(block_num, block_size, total_size):
+    global _last_progress_time
     bar_template = "\r[{}] {:.2f}%"
 
     downloaded = block_num * block_size
     p = downloaded / total_size * 100
+
+    # this is called for every downloaded block (a few KB), 
+    # so redraw the bar at most every 0.1 sec, but always at the start and end.
+    now = time.monotonic()
+    if block_num != 0 and p < 100.0 and now - _last_progress_time < 0.1:
+        return
+    _last_progress_time = now
+
     i = int(downloaded / total_size * 30)
     if p >= 100.0: p = 100.0
     if i >= 30: i = 30
     bar = "#" * i + "." * (30 - i)
-    print(bar_template.format(bar, p), end='')
+    sys.stdout.write(bar_template.format(bar, p))
+    sys.stdout.flush()
 
 
 def get_file(url, file_name=None):
@@ -76,11 +94,58 @@ def get_file(url, file_name=None):
     return file_path
 
 
+def read_gzip(filepath, chunk_size=1 << 20):
+    """
+    Read the whole decompressed content of a gzip file.
+
+    The decompressed size is known from the gzip trailer, so the content is 
+    read in large chunks straight into one preallocated buffer, instead of 
+    collecting the chunks and joining them into a new bytes object.
+
+    Parameters
+    ----------
+    filepath: str
+        path to the gzip file.
+
+    chunk_size: int
+        number of bytes to decompress at a time.
+
+    Returns
+    -------
+    buf: bytearray
+        decompressed content.
+    """
+    # last 4 bytes of a gzip file is the decompressed size (mod 2^32)
+    with open(filepath, 'rb') as f:
+        f.seek(-4, os.SEEK_END)
+        size = int.from_bytes(f.read(4), 'little')
+
+    buf = bytearray(size)
+    n = 0
+    with gzip.open(filepath, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            # copied in place. the buffer only grows if the trailer doesn't
+            # give the full size (content over 4GB or multiple gzip members)
+            buf[n:n + len(chunk)] = chunk
+            n += len(chunk)
+
+    del buf[n:]
+    return buf
+
+
 # -------------------------------------------------------------
 # Dataset core classes: RawDataset / Dataset / RefRawDataset
 # -------------------------------------------------------------
 
 
+def _identity(x):
+    """ default transform of datasets. """
+    return x
+
+
 class RawDataset(metaclass=ABCMeta):
     """
     Dataset which can be either ready / not ready to be used in the models directly.
@@ -93,9 +158,9 @@ class RawDataset(metaclass=ABCMeta):
         self.transform = transform 
         self.target_transform = target_transform
         if self.transform is None:
-            self.transform = lambda x:x
+            self.transform = _identity
         if self.target_transform is None:
-            self.target_transform = lambda x:x
+            self.target_transform = _identity
 
         self.data = None
         self.target = None
@@ -105,6 +170,10 @@ class RawDataset(metaclass=ABCMeta):
             raise ValueError
 
     def __getitem__(self, index):
+        # without transforms, just return the indexed arrays
+        if self.transform is _identity and self.target_transform is _identity:
+            return self.data[index], None if self.target is None else self.target[index]
+
         if self.target is None:
             return self.transform(self.data[index]), None
         else:
@@ -203,15 +272,15 @@ class DataLoader:
         self.shuffle = shuffle
         self.data_size = len(dataset)
         self.max_iter = math.ceil(self.data_size / batch_size)
+        self.index = np.arange(self.data_size)
 
         self.reset()
 
     def reset(self):
         self.iteration = 0
         if self.shuffle:
-            self.index = np.random.permutation(len(self.dataset))
-        else:
-            self.index = np.arange(len(self.dataset))
+            # shuffle in place, not to allocate a new index every epoch
+            np.random.shuffle(self.index)
 
     def __iter__(self):
         return self
@@ -235,14 +304,16 @@ class DataLoader:
 class SequentialDataLoader(DataLoader):
     def __init__(self, dataset, batch_size):
         super().__init__(dataset, batch_size, shuffle=False)
+        # start position of each sequence in a batch. same for every batch.
+        jump = self.data_size // self.batch_size
+        self.offsets = np.arange(self.batch_size) * jump
     
     def __next__(self):
         if self.iteration >= self.max_iter:
             self.reset()
             raise StopIteration
 
-        jump = self.data_size // self.batch_size
-        batch_index = [(i*jump + self.iteration) % self.data_size for i in range(self.batch_size)]
+        batch_index = (self.offsets + self.iteration) % self.data_size
         batch_x, batch_t = self.dataset[batch_index]
 
         self.iteration += 1
@@ -280,6 +351,7 @@ class Corpus:
         self.word2id = {}
         self.id2word = {}
         self.corpus = []
+        self.dtype = None
         self.make_corpus()
 
     def make_corpus(self):
@@ -293,13 +365,7 @@ class Corpus:
             if isinstance(self.docs, RawDataset):
                 doc = doc[0][0] # doc[0] is Dataset.data, where doc[1] here is Dataset.target
 
-            encoded_doc = []
-            for word in doc.split(' '):
-                if word not in self.word2id:
-                    new_id = len(self.word2id)
-                    self.word2id[word] = new_id
-                    self.id2word[new_id] = word
-                encoded_doc.append(self.word2id[word])
+            encoded_doc = self._encode_words(doc.split(' '))
             if self.flatten:
                 self.corpus += encoded_doc
             else:
@@ -310,6 +376,29 @@ class Corpus:
         
         if self.flatten:
             self.corpus = [self.corpus]
+
+        # build the reverse map once, rather than on every new word
+        self.id2word = {word_id: word for word, word_id in self.word2id.items()}
+
+        # smallest integer type to hold word ids, for datasets made from this corpus
+        self.dtype = np.uint16 if len(self.word2id) <= np.iinfo(np.uint16).max + 1 else np.int32
+
+    def _encode_words(self, words):
+        """
+        Convert a list of words into a list of word ids.
+        Words not in the vocabulary yet are given a new id.
+        """
+        # bind to locals, as this runs for every single token in the docs
+        word2id = self.word2id
+        get, setdefault = word2id.get, word2id.setdefault
+
+        encoded = []
+        append = encoded.append
+        for word in words:
+            word_id = get(word)
+            # most words are already known, so setdefault runs only for new ones
+            append(word_id if word_id is not None else setdefault(word, len(word2id)))
+        return encoded
                 
     def get_word(self, word_id):
         return self.id2word[word_id]
@@ -362,7 +451,7 @@ class MNIST(Dataset):
     """ MNIST dataset 28x28 """
 
     def __init__(self, train=True,
-                 transform=Compose([Flatten(), ToFloat(), Normalise(0., 255.)]),
+                 transform=FlattenNormalise(0., 255.),
                  target_transform=None, digits=None):
         super().__init__(train, transform, target_transform)
 
@@ -384,13 +473,11 @@ class MNIST(Dataset):
         self.target = self._load_label(label_path)
 
     def _load_label(self, filepath):
-        with gzip.open(filepath, 'rb') as f:
-            labels = np.frombuffer(f.read(), np.uint8, offset=8)
+        labels = np.frombuffer(read_gzip(filepath), np.uint8, offset=8)
         return labels
 
     def _load_data(self, filepath):
-        with gzip.open(filepath, 'rb') as f:
-            data = np.frombuffer(f.read(), np.uint8, offset=16)
+        data = np.frombuffer(read_gzip(filepath), np.uint8, offset=16)
         data = data.reshape(-1, 1, 28, 28)
         return data
 
@@ -400,15 +487,8 @@ class MNIST(Dataset):
         ----------
         digits: int [0,9] or list of int [0,9]
         """
-        if isinstance(digits, list) or isinstance(digits, np.ndarray):
-            digits = list(set(digits)) # remove duplicates if any
-            idx = np.array([])
-            for d in digits:
-                idx = np.concatenate([idx, np.where(self.target == d)[0]])
-        else: # digits is an int
-            idx = np.where(self.target == digits)[0]
-
-        idx = idx.astype(int)
+        # single pass over the labels. np.isin accepts an int as well as a list.
+        idx = np.flatnonzero(np.isin(self.target, digits))
 
         self.data = self.data[idx]
         self.target = self.target[idx]
@@ -435,6 +515,13 @@ class MNIST(Dataset):
 class NewsGroups(RefRawDataset):
     """ 20 News groups data set"""   
 
+    # lines starting with these (case insensitive) are removed in preprocess
+    headers = ('from:', 'subject:', 'organization:', 'lines:', 'nntp-posting-host:', 
+               'reply-to:', 'in-reply-to:', 'keywords:', 'nf-id:', 'nf-from:', 'originator:',
+               'in article ', 'distribution:', '> in article', '>>in article', '>> in article',
+               'article-i.d.:')
+    max_header_length = max(len(header) for header in headers)
+
     def __init__(self, train=True, transform=None, target_transform=None, preprocess=True):
         self.preprocess = preprocess
         super().__init__(train, transform, target_transform, mode='r', encoding='latin1')
@@ -459,17 +546,35 @@ class NewsGroups(RefRawDataset):
         for i, folder_name in enumerate(folders):
             self.labels[i] = folder_name
             folderpath = os.path.join(datapath, folder_name)
-            self.data += [os.path.join(folderpath, file_name) for file_name in os.listdir(folderpath)]
-            self.target += [i] * len(os.listdir(folderpath))
+            file_names = os.listdir(folderpath)
+            self.data += [os.path.join(folderpath, file_name) for file_name in file_names]
+            self.target += [i] * len(file_names)
+
+        # as arrays, so that a batch can be taken with an index array from DataLoader
+        self.data = np.array(self.data, dtype=object)
+        self.target = np.array(self.target, dtype=np.int16)
 
     def _load_data(self, x):
-        if not isinstance(x, list):
+        if isinstance(x, str):
             x = [x]
 
+        if len(x) > 1:
+            # reading files is I/O bound, so overlap it with threads.
+            # cap the number of threads not to flood the file system.
+            with ThreadPoolExecutor(max_workers=min(len(x), 16)) as executor:
+                docs = list(executor.map(self._read_file, x))
+        else:
+            docs = [self._read_file(f) for f in x]
+
         if self.preprocess:
-            return [NewsGroups.preprocess(open(f, self.mode, encoding=self.encoding).readlines()) for f in x]
+            return [NewsGroups.preprocess(lines) for lines in docs]
         else:
-            return [open(f, self.mode, encoding=self.encoding).read() for f in x]
+            return docs
+
+    def _read_file(self, filepath):
+        """ returns list of lines if preprocess is True, otherwise the whole text """
+        with open(filepath, self.mode, encoding=self.encoding) as f:
+            return f.readlines() if self.preprocess else f.read()
 
     def labels(self):
         return self.labels
@@ -478,25 +583,26 @@ class NewsGroups(RefRawDataset):
     def preprocess(lines):
         
         def is_header(line):
-            headers = ('from:', 'subject:', 'organization:', 'lines:', 'nntp-posting-host:', 
-                       'reply-to:', 'in-reply-to:', 'keywords:', 'nf-id:', 'nf-from:', 'originator:',
-                       'in article ', 'distribution:', '> in article', '>>in article', '>> in article',
-                       'article-i.d.:')
-            return line.lower().startswith(headers)
+            # only lowercase as many characters as the longest header, not the whole line
+            return line[:NewsGroups.max_header_length].lower().startswith(NewsGroups.headers)
         
-        def clean(line):
-            line = replace_tab(line)
-            line = replace_email(line)
-            line = line.replace("'", '') # don't -> dont
-            line = replace_symbols(line)
-            line = line.replace(',', ' ') # remove commas
-            line = line.replace('.', ' .') # consider . as a single word
-            line = replace_numbers(line, '<N>')
-            line = fix_multidots(line)
-            line = single_spacing(line)
-            return line.strip()
-
-        lines = [clean(line) for line in lines if not is_header(line)]
+        def clean(text):
+            text = replace_tab(text)
+            text = replace_email(text)
+            text = text.replace("'", '') # don't -> dont
+            text = replace_symbols(text)
+            text = text.replace(',', ' ') # remove commas
+            text = text.replace('.', ' .') # consider . as a single word
+            text = replace_numbers(text, '<N>')
+            text = fix_multidots(text)
+            text = single_spacing(text)
+            return text
+
+        # none of the cleaning steps matches across a line break, so clean 
+        # the whole document at once: each step is a single scan in C 
+        # instead of one Python call per line.
+        text = clean(''.join([line for line in lines if not is_header(line)]))
+        lines = [line.strip() for line in text.split('\n')]
         return ' '.join([line for line in lines if line != '']).lower() 
 
 
@@ -512,19 +618,23 @@ class NewsGroupsWordInference(Dataset):
         
         print('Creating NewsGroupsWordInference Dataset: Step 2/2')
         target_col = self.window_size//2
+        # collect per-doc arrays and concatenate once at the end,
+        # instead of re-allocating the whole accumulated array for every doc.
+        data, target = [], []
         for i, doc in enumerate(self.corpus.corpus):
-            y = np.array([doc[i:i+self.window_size] for i in range(len(doc) - self.window_size + 1)])
-            if len(y) != 0:
-                if self.data is None:
-                    self.data = np.delete(y, target_col, 1)
-                    self.target = y[:,target_col]
-                else:
-                    self.data = np.concatenate((self.data, np.delete(y, target_col, 1)))
-                    self.target = np.concatenate((self.target, y[:,target_col]))
+            if len(doc) >= self.window_size:
+                # (len(doc) - window_size + 1, window_size) strided view, no copy
+                y = sliding_window_view(np.asarray(doc, dtype=self.corpus.dtype), self.window_size)
+                data.append(np.delete(y, target_col, 1))
+                target.append(y[:,target_col])
 
             if i % 1000 == 0 and i != 0:
                 print(str(i)+"/"+str(len(self.corpus.corpus)) + " docs")
 
+        if data:
+            self.data = np.concatenate(data)
+            self.target = np.concatenate(target)
+
 
 class NewsGroupsLanguageModel(LanguageModelDataset):
     def __init__(self, train=True, len_seq=10, max_doc=None):
@@ -147,6 +147,34 @@ class Normalise(Transform):
         return (batch - mean) / std
 
 
+class FlattenNormalise(Transform):
+    """
+    Same as Compose([Flatten(), AsType(dtype), Normalise(mean, std)]) 
+    but done in a single copy of the batch, normalised in place.
+    Args:
+        mean (float): mean for all values
+        std (float): standard deviation for all values
+        dtype: dtype of the output
+    """
+    def __init__(self, mean=0, std=1, dtype=np.float32):
+        self.mean = mean
+        self.std = std
+        self.dtype = dtype
+
+    def __call__(self, batch):
+        """
+        batch: np.ndarray(n, *dim)
+            n: number of samples in a batch
+            *dim: depends on dataset
+        """
+        batch = batch.reshape(len(batch), -1).astype(self.dtype)
+        if self.mean != 0:
+            batch -= self.mean
+        if self.std != 1:
+            batch /= self.std
+        return batch
+
+
 # -------------------------------------------------------------
 # Transforms for PIL Image
 # -------------------------------------------------------------
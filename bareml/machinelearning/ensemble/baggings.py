@@ -6,8 +6,10 @@ Author: Shota Horii <sh.sinker@gmail.com>
 References:
 """
 
+import os
 import math
 import random
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 from ..base import Classifier, Regressor, Ensemble
@@ -16,28 +18,81 @@ from ..utils.model_selection import bootstrap_sampling
 from ..supervised.decision_trees import DecisionTreeClassifier, DecisionTreeRegressor
 
 
+def _fit_bootstrap(estimator, X, y, sampling_ratio, seed):
+    """ 
+    Fit the estimator on a bootstrap sample of X and y. 
+    Runs in a worker process, hence reseeds the random generators 
+    so that each worker draws a different sample.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+    X_bootstrap, y_bootstrap = bootstrap_sampling(X, y, sampling_ratio)
+    estimator.fit(X_bootstrap, y_bootstrap)
+    return estimator
+
+
 class Bagging(Ensemble):
+    """
+    Parameters
+    ----------
+    estimator: Estimator
+        base estimator to fit on each bootstrap sample
+
+    n_estimators: int
+        number of estimators
+
+    sampling_ratio: float (0, inf)
+        size of each bootstrap sample relative to the training data
+
+    n_jobs: int or None
+        number of processes to fit the estimators in parallel.
+        None or 1 fits them sequentially, -1 uses all the CPUs.
+    """
     
-    def __init__(self, estimator, n_estimators=50, sampling_ratio=1.0):
-        super().__init__(base_estimator=estimator)
+    def __init__(self, estimator, n_estimators=50, sampling_ratio=1.0, n_jobs=None):
+        super().__init__(estimators=[], base_estimator=estimator)
         self.n_estimators = n_estimators
         self.sampling_ratio = sampling_ratio
+        self.n_jobs = n_jobs
 
     def _fit(self, X, y):
 
-        for _ in range(self.n_estimators):
+        self.estimators = []
+
+        if self.n_jobs is None or self.n_jobs == 1:
+            for _ in range(self.n_estimators):
 
-            X_bootstrap, y_bootstrap = bootstrap_sampling(X, y, self.sampling_ratio)
-            estimator = self._make_estimator()
-            estimator.fit(X_bootstrap, y_bootstrap)
+                X_bootstrap, y_bootstrap = bootstrap_sampling(X, y, self.sampling_ratio)
+                estimator = self._make_estimator()
+                estimator.fit(X_bootstrap, y_bootstrap)
+
+        else:
+            # estimators are independent of each other once the bootstrap
+            # sample is drawn, so they can be fitted in separate processes.
+            max_workers = os.cpu_count() if self.n_jobs == -1 else self.n_jobs
+            seeds = np.random.randint(np.iinfo(np.int32).max, size=self.n_estimators)
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(_fit_bootstrap, self._make_estimator(append=False), 
+                                           X, y, self.sampling_ratio, int(seed)) for seed in seeds]
+                self.estimators = [future.result() for future in futures]
         
         return self
 
     def _predict(self, X):
 
-        preds = [ estimator.predict(X) for estimator in self.estimators ]
-        
-        y_pred = np.mean(preds, axis=0)
+        # accumulate the sum in a single buffer rather than 
+        # keeping all the predictions and stacking them for np.mean
+        y_pred = None
+        for estimator in self.estimators:
+            pred = estimator.predict(X)
+            if y_pred is None:
+                y_pred = pred.astype(float)
+            else:
+                y_pred += pred
+
+        y_pred /= len(self.estimators)
 
         if isinstance(self.estimators[0], Classifier):
             y_pred = prob2binary(y_pred)
@@ -53,7 +108,8 @@ class RandomForestClassifier(Bagging, Classifier):
                 max_depth=None, 
                 min_impurity_decrease=None,
                 n_estimators=50, 
-                sampling_ratio=1.0):
+                sampling_ratio=1.0,
+                n_jobs=None):
 
         base_estimator = RandomTreeClassifier(
                     criterion=criterion,
@@ -65,7 +121,8 @@ class RandomForestClassifier(Bagging, Classifier):
         super().__init__(
             estimator=base_estimator,
             n_estimators=n_estimators,
-            sampling_ratio=sampling_ratio
+            sampling_ratio=sampling_ratio,
+            n_jobs=n_jobs
         )
 
 
@@ -77,7 +134,8 @@ class RandomForestRegressor(Bagging, Regressor):
                 max_depth=None, 
                 min_impurity_decrease=None,
                 n_estimators=50, 
-                sampling_ratio=1.0):
+                sampling_ratio=1.0,
+                n_jobs=None):
 
         base_estimator = RandomTreeRegressor(
                     criterion=criterion,
@@ -89,6 +147,7 @@ class RandomForestRegressor(Bagging, Regressor):
         super().__init__(
             estimator=base_estimator,
             n_estimators=n_estimators,
-            sampling_ratio=sampling_ratio
+            sampling_ratio=sampling_ratio,
+            n_jobs=n_jobs
         )
         
\ No newline at end of file
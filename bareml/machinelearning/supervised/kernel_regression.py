@@ -86,7 +86,18 @@ class KernelRidge(Regressor):
         K = self.kernel(X, **self.params)
 
         # self.a will be a (n,) vector
-        self.a = np.linalg.pinv(K + self.alpha * np.eye(n)) @ y
+        # solve (K + alpha*I) a = y directly rather than computing the inverse.
+        # without regularisation K can be singular (e.g. linear kernel with n > d),
+        # then use the minimum norm least squares solution (same as pinv).
+        A = K + self.alpha * np.eye(n)
+        if self.alpha > 0:
+            try:
+                self.a = np.linalg.solve(A, y)
+                return self
+            except np.linalg.LinAlgError:
+                pass
+
+        self.a = np.linalg.lstsq(A, y, rcond=None)[0]
 
         return self
 
@@ -11,8 +11,6 @@ https://scikit-learn.org/stable/modules/metrics.html#pairwise-metrics-affinities
 import math
 import numpy as np
 
-from .metrics import l2_norm
-
 
 def kernel_eligible_pair(X, Y):
     """
@@ -223,6 +221,10 @@ def rbf_kernel(X, Y=None, gamma=None):
         # defaults to 1.0 / n_features
         gamma = 1.0 / len(X[1])
 
-    n, m = len(X), len(Y)
-    K = -gamma * np.array([[ l2_norm(X[i] - Y[j]) for j in range(m)] for i in range(n)]) ** 2
-    return np.exp(K)
\ No newline at end of file
+    # squared euclidean distances for all pairs at once, using
+    # ||x - y||^2 = ||x||^2 + ||y||^2 - 2 x.y
+    sq_dist = (X ** 2).sum(axis=1)[:, np.newaxis] + (Y ** 2).sum(axis=1)[np.newaxis, :] - 2 * (X @ Y.T)
+    # rounding errors can make it slightly negative
+    np.maximum(sq_dist, 0, out=sq_dist)
+
+    return np.exp(-gamma * sq_dist)
\ No newline at end of file